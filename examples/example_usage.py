@@ -1,6 +1,7 @@
 from os import set_blocking
 from selectors import EVENT_READ, DefaultSelector
 from sys import stdin, stdout
+from time import monotonic
 
 from salve_ipc import AUTOCOMPLETE, IPC, Response
 
@@ -19,10 +20,14 @@ def main():
     stdout.write("Code: \n")
     stdout.flush()
 
+    last_input: float = 0.0
     while True:
-        # Check input
-        events = selector.select(0.025)
+        # Check input (often while the user is typing, rarely once idle)
+        timeout: float = 0.025 if monotonic() - last_input < 1 else 0.5
+        events = selector.select(timeout)
         if events:
+            last_input = monotonic()
+
             # Make requests
             for line in stdin:
                 # Update file
@@ -33,9 +38,12 @@ def main():
                     AUTOCOMPLETE,
                     expected_keywords=[],
                     file="test",
-                    current_word=line[-2],
+                    current_word=line[:-1].rpartition(" ")[2],
                 )
 
+        # Keep the server alive (only actually pings once every second)
+        context.ping()
+
         # Check output
         # context.cancel_request("autocomplete") # Uncommenting this line will cause the request to always be cancelled
         output: Response | None = context.get_response(AUTOCOMPLETE)
@@ -16,7 +16,7 @@ def main():
             AUTOCOMPLETE,
             expected_keywords=[],
             file="test",
-            current_word=entry.get()[-1],
+            current_word=entry.get().rpartition(" ")[2],
         )
 
     # Create entry and label
@@ -1,23 +1,31 @@
+from collections import deque
+from io import BytesIO
 from multiprocessing import Pipe, Process, Queue, freeze_support
 from multiprocessing.connection import Connection
 from pathlib import Path
-from random import randint
+from pickle import HIGHEST_PROTOCOL, Pickler
+from sys import intern
+from threading import RLock, Thread
+from time import monotonic
 
 from .misc import (
     COMMAND,
     COMMANDS,
     EDITORCONFIG,
+    VALID_COMMANDS,
     Notification,
+    Ping,
     Request,
-    RequestQueueType,
     Response,
     ResponseQueueType,
+    find_edit,
 )
 from .server import Server
 
 
 class IPC:
     """The IPC class is used to talk to the server and run commands. The public API includes the following methods:
+    - IPC.ping()
     - IPC.request()
     - IPC.cancel_request()
     - IPC.update_file()
@@ -25,72 +33,262 @@ class IPC:
     - IPC.kill_IPC()
     """
 
-    def __init__(self, id_max: int = 15_000) -> None:
-        self.all_ids: list[int] = []
+    def __init__(
+        self,
+        id_max: int = 15_000,
+        ping_interval: float = 1.0,
+        warm_standby: bool = False,
+    ) -> None:
+        self.all_ids: set[int] = set()
         self.id_max = id_max
+        self.next_id: int = 1  # 0 is reserved for the empty case
+        self.free_ids: deque[int] = deque()
+        self.last_ping: float = 0.0
+        self.ping_interval: float = ping_interval
         self.current_ids: dict[str, int] = {}
         self.newest_responses: dict[str, Response | None] = {}
         for command in COMMANDS:
             self.current_ids[command] = 0
             self.newest_responses[command] = None
 
+        # The last state sent of each file, used as the base for patches and to
+        # reseed a new main_server. Holds references, not copies, of the text
         self.files: dict[str, str] = {}
+        # The last expected_keywords sent, which the main_server caches
+        self.sent_keywords: list[str] | None = None
 
         self.response_queue: ResponseQueueType = Queue()
-        self.requests_queue: RequestQueueType = Queue()
+        self.send_buffer: BytesIO = BytesIO()
+        self.pickler: Pickler = Pickler(
+            self.send_buffer, protocol=HIGHEST_PROTOCOL
+        )
+        # Notifications wait here until a Request or Ping needs the server
+        self.pending: list[Request | Notification | Ping] = []
+        self.batch_size: int = 8
         self.client_end: Connection
         self.main_server: Process
+        self.warm_standby: bool = warm_standby
+        self.standby_end: Connection | None = None
+        self.standby_server: Process | None = None
+
+        # Responses are parsed as they arrive by the response_reader thread
+        self.lock = RLock()
+        self.reader_error: Exception | None = None  # Raised by get_response()
+        self.response_reader: Thread | None = None
         self.create_server()
 
     def create_server(self) -> None:
         """Creates the main_server through a subprocess - internal API"""
-        self.client_end, server_end = Pipe()
+        self.retire_ids()
+
+        # A fresh main_server has no files or keyword list cached and
+        # self.files already holds whatever was still pending
+        self.sent_keywords = None
+        self.pending.clear()
+
+        # Promote the warm standby so we don't wait on a cold start
+        if (
+            self.standby_server is not None
+            and self.standby_end is not None
+            and self.standby_server.is_alive()
+        ):
+            self.main_server = self.standby_server
+            self.client_end = self.standby_end
+            self.standby_server = None
+            self.standby_end = None
+        else:
+            self.main_server, self.client_end = self.spawn_server()
+
+        if self.warm_standby:
+            self.standby_server, self.standby_end = self.spawn_server()
+
+        # Started after the first spawn so that one forks single threaded
+        if self.response_reader is None:
+            self.response_reader = Thread(
+                target=self.read_responses, daemon=True
+            )
+            self.response_reader.start()
+
+        for file, contents in self.files.items():
+            self.send_notification(file, contents=contents)
+
+    def spawn_server(self) -> tuple[Process, Connection]:
+        """Starts a Server subprocess and returns it with the client end of its Pipe - internal API"""
+        server_end, client_end = Pipe(duplex=False)
+
+        # Under fork the child inherits every write end we hold and only sees
+        # EOF on its own Pipe once it has closed all of them
+        held_ends: list[Connection] = [client_end]
+        for end in (getattr(self, "client_end", None), self.standby_end):
+            if end is not None:
+                held_ends.append(end)
+
         freeze_support()
-        self.main_server = Process(
+        server = Process(
             target=Server,
-            args=(server_end, self.response_queue, self.requests_queue),
+            args=(server_end, self.response_queue, held_ends),
             daemon=True,
         )
-        self.main_server.start()
+        server.start()
+        server_end.close()
+        return server, client_end
+
+    def retire_ids(self) -> None:
+        """Frees the ids a stopped main_server never answered, but only once the response_reader is past anything it did send - internal API"""
+        with self.lock:
+            retired: list[int] = list(self.all_ids)
+            self.all_ids.clear()
+            for command in COMMANDS:
+                self.current_ids[command] = 0
 
-        files_copy = self.files.copy()
-        self.files = {}
-        for file, data in files_copy.items():
-            self.update_file(file, data)
+        # Queued behind the old main_server's responses so none of them can
+        # be mistaken for the answer to a new message using a reused id
+        if retired:
+            self.response_queue.put(retired)
 
-    def create_message(self, type: str, **kwargs) -> None:
-        """Creates a Message based on the args and kwawrgs provided. Highly flexible. - internal API"""
-        id = randint(1, self.id_max)  # 0 is reserved for the empty case
-        while id in self.all_ids:
-            id = randint(1, self.id_max)
-        self.all_ids.append(id)
+    def allocate_id(self) -> int:
+        """Hands out an unused id, reusing ids the main_server has already responded to first - internal API"""
+        with self.lock:
+            if self.free_ids:
+                id = self.free_ids.popleft()
+            elif self.next_id <= self.id_max:
+                id = self.next_id
+                self.next_id += 1
+            else:
+                self.kill_IPC()
+                raise Exception(f"All {self.id_max} ids are already in use!")
 
+            self.all_ids.add(id)
+            return id
+
+    def send_message(self, message: Request | Notification | Ping) -> None:
+        """Queues a Message and sends the batch once it reaches batch_size - internal API"""
+        self.pending.append(message)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Pickles all queued Messages into the reused send buffer and sends them to the main_server at once - internal API"""
+        if not self.pending:
+            return
+
+        self.send_buffer.seek(0)
+        self.send_buffer.truncate()
+        self.pickler.clear_memo()
+        self.pickler.dump(self.pending)
+        try:
+            with self.send_buffer.getbuffer() as data:
+                self.client_end.send_bytes(data)
+        except OSError:  # The main_server died after check_server()
+            sent = False
+        else:
+            sent = True
+
+        # Outside the except so its traceback no longer holds the buffer
+        if not sent:
+            self.resend_after_restart()
+            return
+        self.pending.clear()
+
+    def resend_after_restart(self) -> None:
+        """Restarts the main_server and resends the unsent Requests and Pings under new ids - internal API"""
+        unsent: list[Request | Notification | Ping] = self.pending.copy()
+        keywords: list[str] | None = self.sent_keywords
+        newest_ids: dict[str, int] = self.current_ids.copy()
+
+        # Reseeds self.files, which already covers every unsent Notification
+        self.create_server()
+
+        for message in unsent:
+            match message:
+                case Request():
+                    with self.lock:
+                        # Skip Requests that were cancelled or replaced
+                        if newest_ids[message.command] != message.id:
+                            continue
+                        id = self.allocate_id()
+                        self.current_ids[message.command] = id
+
+                    # The new main_server has no keyword list cached yet
+                    if message.expected_keywords is None:
+                        message = message._replace(expected_keywords=keywords)
+                    self.sent_keywords = keywords
+                    self.send_message(message._replace(id=id))
+                case Ping():
+                    self.send_message(Ping(self.allocate_id()))
+        self.flush()
+
+    def check_server(self) -> None:
+        """Restarts the main_server if it has died - internal API"""
         if not self.main_server.is_alive():
             self.create_server()
 
-        match type:
-            case "request":
-                command = kwargs.get("command", "")
-                self.current_ids[command] = id
-                request: Request = {
-                    "id": id,
-                    "type": type,
-                    "command": command,
-                    "file": "",
-                }
-                request.update(**kwargs)
-                # print(request)
-                self.requests_queue.put(request)
-            case "notification":
-                notification: Notification = {
-                    "id": id,
-                    "type": type,
-                    "remove": False,
-                    "file": "",
-                    "contents": "",
-                }
-                notification.update(**kwargs)
-                self.requests_queue.put(notification)
+    def send_request(
+        self,
+        command: COMMAND,
+        file: str,
+        expected_keywords: list[str],
+        current_word: str,
+        language: str,
+        text_range: tuple[int, int],
+        file_path: Path | str,
+        definition_starters: list[tuple[str, str]],
+    ) -> None:
+        """Sends a Request and marks it as the newest of its command - internal API"""
+        self.check_server()
+        with self.lock:
+            id = self.allocate_id()
+            self.current_ids[command] = id
+
+        # Keyword lists rarely change so only send them when they do
+        keywords: list[str] | None = expected_keywords
+        if expected_keywords == self.sent_keywords:
+            keywords = None
+        else:
+            self.sent_keywords = expected_keywords.copy()
+
+        self.send_message(
+            Request(
+                id,
+                command,
+                file,
+                keywords,
+                current_word,
+                language,
+                text_range,
+                file_path,
+                definition_starters,
+            )
+        )
+        self.flush()
+
+    def send_notification(
+        self,
+        file: str,
+        remove: bool = False,
+        contents: str = "",
+        patch: tuple[int, int] | None = None,
+    ) -> None:
+        """Sends a Notification to add, patch, or remove a file - internal API"""
+        self.check_server()
+        self.send_message(
+            Notification(self.allocate_id(), file, remove, contents, patch)
+        )
+
+    def send_ping(self) -> None:
+        """Sends a Ping - internal API"""
+        self.check_server()
+        self.send_message(Ping(self.allocate_id()))
+        self.flush()
+
+    def ping(self) -> None:
+        """Checks that the main_server is alive (restarting it if needed) at most once every ping_interval seconds - external API"""
+        now: float = monotonic()
+        if now - self.last_ping < self.ping_interval:
+            return
+
+        self.last_ping = now
+        self.send_ping()
 
     def request(
         self,
@@ -104,7 +302,7 @@ class IPC:
         definition_starters: list[tuple[str, str]] = [("", "before")],
     ) -> None:
         """Sends the main_server a request of type command with given kwargs - external API"""
-        if command not in COMMANDS:
+        if command not in VALID_COMMANDS:
             self.kill_IPC()
             raise Exception(
                 f"Command {command} not in builtin commands. Those are {COMMANDS}!"
@@ -114,32 +312,43 @@ class IPC:
             self.kill_IPC()
             raise Exception(f"File {file} does not exist in system!")
 
-        self.create_message(
-            type="request",
-            command=command,
-            file=file,
-            expected_keywords=expected_keywords,
-            current_word=current_word,
-            language=language,
-            text_range=text_range,
-            file_path=file_path,
-            definition_starters=definition_starters,
+        # Interned strings make dict lookups an identity check and let the
+        # Pickler memoize them. intern() rejects str subclasses and str() of a
+        # (str, Enum) member is its name, so take the plain str value instead
+        command = intern(str.__str__(command))
+        language = intern(str.__str__(language))
+
+        self.send_request(
+            command,
+            file,
+            expected_keywords,
+            current_word,
+            language,
+            text_range,
+            file_path,
+            definition_starters,
         )
 
     def cancel_request(self, command: str):
         """Cancels a request of type command - external API"""
-        if command not in COMMANDS:
+        if command not in VALID_COMMANDS:
             self.kill_IPC()
             raise Exception(
                 f"Cannot cancel command {command}, valid commands are {COMMANDS}"
             )
 
-        self.current_ids[command] = 0
+        # The response may have already been read in the background
+        with self.lock:
+            self.current_ids[command] = 0
+            self.newest_responses[command] = None
 
     def parse_response(self, res: Response) -> None:
         """Parses main_server output line and discards useless responses - internal API"""
         id = res["id"]
+        if id not in self.all_ids:  # Left over from a replaced main_server
+            return
         self.all_ids.remove(id)
+        self.free_ids.append(id)
 
         if "command" not in res:
             return
@@ -151,41 +360,82 @@ class IPC:
         self.current_ids[command] = 0
         self.newest_responses[command] = res
 
-    def check_responses(self) -> None:
-        """Checks all main_server output by calling IPC.parse_line() on each response - internal API"""
-        while not self.response_queue.empty():
-            self.parse_response(self.response_queue.get())
+    def read_responses(self) -> None:
+        """Waits on main_server output and calls IPC.parse_response() on each response as it arrives. Runs in the response_reader thread until IPC.kill_IPC() sends None - internal API"""
+        while True:
+            try:
+                response: Response | list[int] | None = (
+                    self.response_queue.get()
+                )
+                if response is None:
+                    return
+
+                with self.lock:
+                    if isinstance(response, list):  # From IPC.retire_ids()
+                        self.free_ids.extend(response)
+                        continue
+                    self.parse_response(response)
+            except Exception as error:  # Keep reading, tell the caller later
+                with self.lock:
+                    self.reader_error = error
 
     def get_response(self, command: str) -> Response | None:
-        """Runs IPC.check_responses() and returns the current response of type command if it has been returned - external API"""
-        if command not in COMMANDS:
+        """Returns the current response of type command if it has been returned - external API"""
+        if command not in VALID_COMMANDS:
             self.kill_IPC()
             raise Exception(
                 f"Cannot get response of command {command}, valid commands are {COMMANDS}"
             )
 
-        self.check_responses()
-        response: Response | None = self.newest_responses[command]
-        self.newest_responses[command] = None
+        with self.lock:
+            if self.reader_error is not None:
+                error: Exception = self.reader_error
+                self.reader_error = None
+                raise error
+
+            response: Response | None = self.newest_responses[command]
+            self.newest_responses[command] = None
         return response
 
     def update_file(self, file: str, current_state: str) -> None:
         """Updates files in the system - external API"""
+        if file not in self.files:
+            self.send_notification(file, contents=current_state)
+            self.files[file] = current_state
+            return
 
-        self.files[file] = current_state
+        start, end, contents = find_edit(self.files[file], current_state)
+        if start == end and not contents:
+            return
 
-        self.create_message("notification", file=file, contents=current_state)
+        # Only send the changed span, the server already has the rest
+        self.send_notification(file, contents=contents, patch=(start, end))
+        self.files[file] = current_state
 
     def remove_file(self, file: str) -> None:
         """Removes a file from the main_server - external API"""
-        if file not in list(self.files.keys()):
+        if file not in self.files:
             self.kill_IPC()
             raise Exception(
                 f"Cannot remove file {file} as file is not in file database!"
             )
 
-        self.create_message("notification", remove=True, file=file)
+        # Removed after sending so a restarted main_server still has the
+        # file to remove
+        self.send_notification(file, remove=True)
+        self.files.pop(file)
 
     def kill_IPC(self) -> None:
         """Kills the main_server when salve_ipc's services are no longer required - external API"""
         self.main_server.kill()
+        self.main_server.join()  # So check_server() sees it as dead
+        if self.standby_server is not None:
+            self.standby_server.kill()
+            self.standby_server = None
+            self.standby_end = None
+
+        self.pending.clear()
+        self.retire_ids()
+        if self.response_reader is not None:
+            self.response_queue.put(None)  # Stops the response_reader
+            self.response_reader = None
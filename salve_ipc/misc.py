@@ -1,6 +1,6 @@
 from multiprocessing.queues import Queue as GenericQueueClass
 from pathlib import Path
-from typing import TYPE_CHECKING, NotRequired, TypedDict
+from typing import TYPE_CHECKING, NamedTuple, NotRequired, TypedDict
 
 COMMANDS: list[str] = [
     "autocomplete",
@@ -17,35 +17,45 @@ HIGHLIGHT: COMMAND = COMMANDS[2]
 EDITORCONFIG: COMMAND = COMMANDS[3]
 DEFINITION: COMMAND = COMMANDS[4]
 
+VALID_COMMANDS: frozenset[str] = frozenset(COMMANDS)  # For membership checks
 
-class Message(TypedDict):
-    """Base class for messages in and out of the server"""
+
+class Ping(NamedTuple):
+    """Keeps the server alive and lets the IPC check that it is still running"""
 
     id: int
-    type: str  # Can be "request", "response", "notification"
 
 
-class Request(Message):
+class Request(NamedTuple):
     """Request results/output from the server with command specific input"""
 
+    id: int
     command: str  # Can only be commands in COMMANDS
     file: str
-    expected_keywords: NotRequired[list[str]]  # autocomplete, replacements
-    current_word: NotRequired[str]  # autocomplete, replacements, definition
-    language: NotRequired[str]  # highlight
-    text_range: NotRequired[tuple[int, int]]  # highlight
-    file_path: NotRequired[Path | str]  # editorconfig
-    definition_starters: NotRequired[
-        list[tuple[str, str]]
-    ]  # definition (list of regexes)
+    # autocomplete, replacements (None reuses the last list the server got)
+    expected_keywords: list[str] | None
+    current_word: str  # autocomplete, replacements, definition
+    language: str  # highlight
+    text_range: tuple[int, int]  # highlight
+    file_path: Path | str  # editorconfig
+    definition_starters: list[tuple[str, str]]  # definition (list of regexes)
 
 
-class Notification(Message):
+class Notification(NamedTuple):
     """Notifies the server to add/update/remove a file for usage in fulfilling commands"""
 
+    id: int
     file: str
-    remove: bool
-    contents: NotRequired[str]
+    remove: bool = False
+    contents: str = ""  # Full text, or the replacement text if patch is set
+    patch: tuple[int, int] | None = None  # (start, end) span being replaced
+
+
+class Message(TypedDict):
+    """Base class for messages out of the server"""
+
+    id: int
+    type: str  # Always "response"
 
 
 class Response(Message):
@@ -59,10 +69,38 @@ class Response(Message):
 
 
 if TYPE_CHECKING:
-    ResponseQueueType = GenericQueueClass[Response]
-    RequestQueueType = GenericQueueClass[Request | Notification]
+    # Also carries retired ids and the None that stops the response reader
+    ResponseQueueType = GenericQueueClass[Response | list[int] | None]
 # Else, this is CPython < 3.12. We are now in the No Man's Land
 # of Typing. In this case, avoid subscripting "GenericQueue". Ugh.
 else:
     ResponseQueueType = GenericQueueClass
-    RequestQueueType = GenericQueueClass
+
+
+def find_edit(old: str, new: str) -> tuple[int, int, str]:
+    """Returns the (start, end) span of old that must be replaced and the text to replace it with to get new"""
+    shortest: int = min(len(old), len(new))
+
+    # Binary search the common prefix and suffix so comparisons stay in C,
+    # only comparing the part not yet known to match to keep copying O(n)
+    low, high = 0, shortest
+    while low < high:
+        middle = (low + high + 1) // 2
+        if old[low:middle] == new[low:middle]:
+            low = middle
+        else:
+            high = middle - 1
+    start: int = low
+
+    low, high = 0, shortest - start
+    while low < high:
+        middle = (low + high + 1) // 2
+        if (
+            old[len(old) - middle : len(old) - low]
+            == new[len(new) - middle : len(new) - low]
+        ):
+            low = middle
+        else:
+            high = middle - 1
+
+    return start, len(old) - low, new[start : len(new) - low]
@@ -1,14 +1,14 @@
 from multiprocessing.connection import Connection
 from multiprocessing.queues import Queue as GenericClassQueue
-from time import sleep
+from pickle import loads
 
 from pyeditorconfig import get_config
 
 from .misc import (
     COMMANDS,
     Notification,
+    Ping,
     Request,
-    RequestQueueType,
     Response,
     ResponseQueueType,
 )
@@ -28,11 +28,12 @@ class Server:
         self,
         server_end: Connection,
         response_queue: GenericClassQueue,
-        requests_queue: GenericClassQueue,
+        client_ends: list[Connection],
     ) -> None:
         self.server_end: Connection = server_end
+        for client_end in client_ends:  # Inherited from the IPC under fork
+            client_end.close()
         self.response_queue: ResponseQueueType = response_queue
-        self.requests_queue: RequestQueueType = requests_queue
         self.all_ids: list[int] = []
         self.newest_ids: dict[str, int] = {}
         self.newest_requests: dict[str, Request | None] = {}
@@ -41,10 +42,15 @@ class Server:
             self.newest_requests[command] = None
 
         self.files: dict[str, str] = {}
+        self.expected_keywords: list[str] = []
 
         while True:
-            self.run_tasks()
-            sleep(0.0025)
+            try:
+                # Sleep until the IPC sends something instead of polling
+                self.server_end.poll(None)
+                self.run_tasks()
+            except EOFError:  # The IPC closed its end of the Pipe
+                return
 
     def simple_id_response(self, id: int, cancelled: bool = True) -> None:
         response: Response = {
@@ -54,30 +60,43 @@ class Server:
         }
         self.response_queue.put(response)
 
-    def parse_line(self, message: Request | Notification) -> None:
-        id: int = message["id"]
-        match message["type"]:
-            case "notification":
-                file: str = message["file"]  # type: ignore
-                if message["remove"]:  # type: ignore
-                    self.files.pop(file)
-                    return
-                contents: str = message["contents"]  # type: ignore
-                self.files[file] = contents
+    def parse_line(self, message: Request | Notification | Ping) -> None:
+        id: int = message.id
+        match message:
+            case Notification():
+                if message.remove:
+                    self.files.pop(message.file)
+                elif message.patch is None:
+                    self.files[message.file] = message.contents
+                else:
+                    start, end = message.patch
+                    old_contents: str = self.files[message.file]
+                    self.files[message.file] = (
+                        old_contents[:start]
+                        + message.contents
+                        + old_contents[end:]
+                    )
                 self.simple_id_response(id, False)
-            case "request":
+            case Request():
+                if message.expected_keywords is None:
+                    message = message._replace(
+                        expected_keywords=self.expected_keywords
+                    )
+                else:
+                    self.expected_keywords = message.expected_keywords
                 self.all_ids.append(id)
-                command: str = message["command"]  # type: ignore
-                self.newest_ids[command] = id
-                self.newest_requests[command] = message  # type: ignore
+                self.newest_ids[message.command] = id
+                self.newest_requests[message.command] = message
+            case Ping():
+                self.simple_id_response(id, False)
             case _:
                 self.simple_id_response(id)
 
     def cancel_all_ids_except_newest(self) -> None:
         ids = [
-            id["id"]
-            for id in list(self.newest_requests.values())
-            if id is not None
+            request.id
+            for request in list(self.newest_requests.values())
+            if request is not None
         ]
         for id in self.all_ids:
             if id in ids:
@@ -87,41 +106,41 @@ class Server:
         self.all_ids = []
 
     def handle_request(self, request: Request) -> None:
-        command: str = request["command"]
+        command: str = request.command
         id: int = self.newest_ids[command]
-        file: str = request["file"]
+        file: str = request.file
         result: (
             list[str | tuple[tuple[int, int], int, str]] | dict[str, str]
         ) = []
         cancelled: bool = False
 
-        match request["command"]:
+        match request.command:
             case "autocomplete":
                 result = find_autocompletions(
                     full_text=self.files[file],
-                    expected_keywords=request["expected_keywords"],  # type: ignore
-                    current_word=request["current_word"],  # type: ignore
+                    expected_keywords=request.expected_keywords,
+                    current_word=request.current_word,
                 )
             case "replacements":
                 result = get_replacements(
                     full_text=self.files[file],
-                    expected_keywords=request["expected_keywords"],  # type: ignore
-                    replaceable_word=request["current_word"],  # type: ignore
+                    expected_keywords=request.expected_keywords,
+                    replaceable_word=request.current_word,
                 )
             case "highlight":
                 pre_refined_result: list[Token] = get_highlights(
                     full_text=self.files[file],
-                    language=request["language"],  # type: ignore
-                    text_range=request["text_range"],  # type: ignore
+                    language=request.language,
+                    text_range=request.text_range,
                 )
                 result += [token for token in pre_refined_result]  # type: ignore
             case "editorconfig":
-                result = get_config(request["file_path"])  # type: ignore
+                result = get_config(request.file_path)  # type: ignore
             case "definition":
                 result = get_definition(
                     self.files[file],
-                    request["definition_starters"],  # type: ignore
-                    request["current_word"],  # type: ignore
+                    request.definition_starters,
+                    request.current_word,
                 )
             case _:
                 cancelled = True
@@ -137,8 +156,9 @@ class Server:
         self.newest_ids[command] = 0
 
     def run_tasks(self) -> None:
-        while not self.requests_queue.empty():
-            self.parse_line(self.requests_queue.get())
+        while self.server_end.poll():
+            for message in loads(self.server_end.recv_bytes()):
+                self.parse_line(message)
 
         self.cancel_all_ids_except_newest()
 
@@ -152,5 +172,5 @@ class Server:
             if request is None:
                 continue
             self.handle_request(request)
-            command: str = request["command"]
+            command: str = request.command
             self.newest_requests[command] = None
@@ -0,0 +1,27 @@
+from salve_ipc.misc import find_edit
+
+
+def apply_edit(old: str, edit: tuple[int, int, str]) -> str:
+    start, end, contents = edit
+    return old[:start] + contents + old[end:]
+
+
+def test_find_edit():
+    assert find_edit("", "") == (0, 0, "")
+    assert find_edit("", "new") == (0, 0, "new")
+    assert find_edit("old", "") == (0, 3, "")
+    assert find_edit("this", "this") == (4, 4, "")
+    assert find_edit("this", "thisx") == (4, 4, "x")
+    assert find_edit("this is", "this was") == (5, 6, "wa")
+    assert find_edit("abc", "axc") == (1, 2, "x")
+    assert find_edit("aaaa", "aaa") == (3, 4, "")
+
+    pairs: list[tuple[str, str]] = [
+        ("def foo():\n    pass\n", "def foobar():\n    pass\n"),
+        ("x = 1\ny = 2\n", "x = 1\n\ny = 2\n"),
+        ("abcabc", "abc"),
+        ("ab", "ba"),
+        ("\u200bhidden", "hidden"),
+    ]
+    for old, new in pairs:
+        assert apply_edit(old, find_edit(old, new)) == new
@@ -1,5 +1,8 @@
+from enum import Enum
 from time import sleep
 
+from pytest import MonkeyPatch, raises
+
 from salve_ipc import (
     AUTOCOMPLETE,
     DEFINITION,
@@ -9,6 +12,7 @@ from salve_ipc import (
     REPLACEMENTS,
     Response,
 )
+from salve_ipc.misc import Notification, Ping, Request
 
 
 def test_IPC():
@@ -152,5 +156,402 @@ def test_IPC():
     context.kill_IPC()
 
 
+def test_server_exits_when_pipe_closes():
+    context = IPC()
+    server = context.main_server
+
+    context.client_end.close()
+    server.join(5)
+    assert not server.is_alive()
+
+    context.kill_IPC()
+
+
+def test_warm_standby():
+    context = IPC()
+    assert context.standby_server is None
+    context.kill_IPC()
+
+    context = IPC(warm_standby=True)
+    context.update_file("test", "this thing")
+    standby = context.standby_server
+
+    context.main_server.kill()
+    context.main_server.join()
+    context.request(
+        AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+    )
+    assert context.main_server is standby
+    assert context.standby_server is not None
+    assert context.standby_server.is_alive()
+
+    sleep(1)
+    output: Response | None = context.get_response(AUTOCOMPLETE)
+    if output is None:
+        raise AssertionError("Autocomplete output is None")
+    assert output["result"] == ["this", "thing"]
+
+    context.kill_IPC()
+
+
+def test_reader_errors_reach_get_response():
+    context = IPC()
+    context.update_file("test", "this thing")
+
+    context.response_queue.put({"type": "response"})  # type: ignore
+    sleep(1)
+    with raises(KeyError):
+        context.get_response(AUTOCOMPLETE)
+
+    # The reader keeps going after the error
+    context.request(
+        AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+    )
+    sleep(1)
+    output: Response | None = context.get_response(AUTOCOMPLETE)
+    if output is None:
+        raise AssertionError("Autocomplete output is None")
+    assert output["result"] == ["this", "thing"]
+
+    context.kill_IPC()
+
+
+def test_kill_IPC_stops_reader():
+    context = IPC()
+    reader = context.response_reader
+    assert reader is not None
+
+    context.kill_IPC()
+    reader.join(5)
+    assert not reader.is_alive()
+    assert context.response_reader is None
+
+    # Using the IPC again brings everything back
+    context.update_file("test", "this thing")
+    context.request(
+        AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+    )
+    assert context.response_reader is not None
+    sleep(1)
+    output: Response | None = context.get_response(AUTOCOMPLETE)
+    if output is None:
+        raise AssertionError("Autocomplete output is None")
+    assert output["result"] == ["this", "thing"]
+
+    context.kill_IPC()
+
+
+def record_requests(context: IPC) -> list[Request]:
+    """Returns a list that every Request the context sends is added to"""
+    requests: list[Request] = []
+    send_message = context.send_message
+
+    def record(message: Request | Notification | Ping) -> None:
+        if isinstance(message, Request):
+            requests.append(message)
+        send_message(message)
+
+    context.send_message = record  # type: ignore
+    return requests
+
+
+def wait_for_response(context: IPC, command: str) -> Response:
+    for _ in range(100):
+        response: Response | None = context.get_response(command)
+        if response is not None:
+            return response
+        sleep(0.05)
+    raise AssertionError(f"{command} output is None")
+
+
+def test_ping(monkeypatch: MonkeyPatch):
+    context = IPC(ping_interval=0.2)
+    pings: list[Ping] = []
+    send_message = context.send_message
+
+    def record(message: Request | Notification | Ping) -> None:
+        if isinstance(message, Ping):
+            pings.append(message)
+        send_message(message)
+
+    monkeypatch.setattr(context, "send_message", record)
+
+    # Back to back pings only send one Ping
+    context.ping()
+    context.ping()
+    assert len(pings) == 1
+
+    # Once ping_interval has passed another is sent
+    sleep(0.3)
+    context.ping()
+    assert len(pings) == 2
+
+    # And a dead main_server is restarted
+    old_server = context.main_server
+    old_server.kill()
+    old_server.join()
+    sleep(0.3)
+    context.ping()
+    assert len(pings) == 3
+    assert context.main_server is not old_server
+    assert context.main_server.is_alive()
+
+    context.kill_IPC()
+
+
+def test_keyword_cache():
+    context = IPC()
+    context.update_file("test", "hello world")
+    requests: list[Request] = record_requests(context)
+
+    keywords: list[str] = ["thanks"]
+    context.request(
+        AUTOCOMPLETE,
+        file="test",
+        expected_keywords=keywords,
+        current_word="th",
+    )
+    assert requests[-1].expected_keywords == ["thanks"]
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == ["thanks"]
+
+    # An equal list is not sent again and the server reuses its copy
+    context.request(
+        AUTOCOMPLETE,
+        file="test",
+        expected_keywords=["thanks"],
+        current_word="th",
+    )
+    assert requests[-1].expected_keywords is None
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == ["thanks"]
+
+    # Changing the list the caller passed before is still noticed
+    keywords.append("those")
+    context.request(
+        AUTOCOMPLETE,
+        file="test",
+        expected_keywords=keywords,
+        current_word="th",
+    )
+    assert requests[-1].expected_keywords == ["thanks", "those"]
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == [
+        "those",
+        "thanks",
+    ]
+
+    # Other commands send their default list which replaces the cached one
+    context.request(DEFINITION, file="test", current_word="hello")
+    assert requests[-1].expected_keywords == [""]
+    wait_for_response(context, DEFINITION)
+    context.request(
+        AUTOCOMPLETE,
+        file="test",
+        expected_keywords=keywords,
+        current_word="th",
+    )
+    assert requests[-1].expected_keywords == ["thanks", "those"]
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == [
+        "those",
+        "thanks",
+    ]
+
+    context.kill_IPC()
+
+
+def test_str_subclass_commands():
+    class Command(str, Enum):
+        AUTOCOMPLETE = AUTOCOMPLETE
+        HIGHLIGHT = HIGHLIGHT
+
+    class Language(str):
+        pass
+
+    context = IPC()
+    context.update_file("test", "this thing")
+    context.request(
+        Command.AUTOCOMPLETE,
+        file="test",
+        expected_keywords=[],
+        current_word="th",
+    )
+    context.request(
+        Command.HIGHLIGHT, file="test", language=Language("python")
+    )
+
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == [
+        "this",
+        "thing",
+    ]
+    assert wait_for_response(context, Command.HIGHLIGHT)["result"]
+
+    context.kill_IPC()
+
+
+def test_batching():
+    context = IPC()
+
+    # Notifications wait for a Request and are applied in order
+    context.update_file("test", "this")
+    context.update_file("test", "this thing")
+    context.remove_file("test")
+    context.update_file("test", "that there")
+    assert [
+        (message.remove, message.patch) for message in context.pending
+    ] == [(False, None), (False, (4, 4)), (True, None), (False, None)]
+
+    context.request(
+        AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+    )
+    assert context.pending == []
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == [
+        "that",
+        "there",
+    ]
+
+    # Or a Ping
+    context.update_file("test", "that there thing")
+    assert len(context.pending) == 1
+    context.ping()
+    assert context.pending == []
+
+    # Or until batch_size Messages are waiting
+    for i in range(context.batch_size - 1):
+        context.update_file(f"file {i}", "this")
+    assert len(context.pending) == context.batch_size - 1
+    context.update_file("last file", "this")
+    assert context.pending == []
+
+    context.kill_IPC()
+
+
+def test_ids_are_reused():
+    context = IPC(id_max=2)
+    context.update_file("test", "this")
+    context.request(
+        AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+    )
+    wait_for_response(context, AUTOCOMPLETE)
+    assert context.all_ids == set()
+    assert sorted(context.free_ids) == [1, 2]
+
+    # Two ids are enough for any number of answered messages
+    for word in ["this thing", "this thing that", "this thing that there"]:
+        context.update_file("test", word)
+        context.request(
+            AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+        )
+        # Each update is a patch, so this also checks the server applied it
+        response: Response = wait_for_response(context, AUTOCOMPLETE)
+        assert sorted(response["result"]) == sorted(word.split())
+    assert context.next_id == 3
+
+    context.kill_IPC()
+
+
+def test_ids_run_out():
+    context = IPC(id_max=2)
+    # Notifications wait to be sent so none of these ids get answered
+    context.update_file("test", "this")
+    context.update_file("other", "that")
+    with raises(Exception, match="ids are already in use"):
+        context.update_file("third", "there")
+    assert not context.main_server.is_alive()
+
+
+def test_restart_releases_ids_and_restores_files():
+    context = IPC()
+    context.update_file("test", "this thing")  # Never reaches the server
+    assert context.all_ids == {1}
+
+    context.main_server.kill()
+    context.main_server.join()
+    context.request(
+        AUTOCOMPLETE, file="test", expected_keywords=[], current_word="th"
+    )
+
+    # The new main_server was given the file
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == [
+        "this",
+        "thing",
+    ]
+
+    # The id the dead main_server never answered is free again
+    for _ in range(100):
+        if 1 in context.free_ids:
+            break
+        sleep(0.05)
+    assert 1 in context.free_ids
+    assert context.all_ids == set()
+
+    context.kill_IPC()
+
+
+def test_send_survives_server_death(monkeypatch: MonkeyPatch):
+    context = IPC()
+    context.update_file("test", "hello world")
+    context.request(
+        AUTOCOMPLETE,
+        file="test",
+        expected_keywords=["thanks"],
+        current_word="th",
+    )
+    wait_for_response(context, AUTOCOMPLETE)
+
+    # The main_server dies between check_server() and the write
+    old_server = context.main_server
+    old_server.kill()
+    old_server.join()
+    monkeypatch.setattr(context, "check_server", lambda: None)
+    context.request(
+        AUTOCOMPLETE,
+        file="test",
+        expected_keywords=["thanks"],
+        current_word="th",
+    )
+
+    # The Request was resent to a new main_server with its keywords in full
+    assert context.main_server is not old_server
+    assert context.main_server.is_alive()
+    assert wait_for_response(context, AUTOCOMPLETE)["result"] == ["thanks"]
+
+    context.kill_IPC()
+
+
+def test_kill_IPC_releases_ids():
+    context = IPC()
+    context.update_file("test", "this")
+    assert context.all_ids == {1}
+    reader = context.response_reader
+    assert reader is not None
+
+    context.kill_IPC()
+    reader.join(5)
+    assert context.all_ids == set()
+    assert list(context.free_ids) == [1]
+    assert context.current_ids[AUTOCOMPLETE] == 0
+
+
+def test_remove_file():
+    context = IPC()
+    context.update_file("test", "this")
+    context.update_file("other", "that")
+
+    context.remove_file("test")
+    assert context.files == {"other": "that"}
+
+    # A restarted main_server is only given the files that are left
+    context.main_server.kill()
+    context.main_server.join()
+    context.check_server()
+    assert [
+        (notification.file, notification.contents)
+        for notification in context.pending
+    ] == [("other", "that")]
+
+    with raises(Exception, match="not in file database"):
+        context.remove_file("test")
+
+    context.kill_IPC()
+
+
 if __name__ == "__main__":
     test_IPC()